@@ -83,7 +83,10 @@ echo "--------------------------------------------------------------------------
 echo "[Packing] Log Parser"
 echo "------------------------------------------------------------------------------"
 cd "$source_dir"/log_parser || exit 1
-pip3 install -r requirements.txt --target ./package
+# orjson ships compiled wheels; fetch the ones matching the Lambda runtime
+# rather than the build host
+pip3 install -r requirements.txt --target ./package --platform manylinux2014_x86_64 \
+    --implementation cp --python-version 3.10 --only-binary=:all:
 cd "$source_dir"/log_parser/package || exit 1
 zip -q -r9 "$build_dist_dir"/log_parser.zip .
 cd "$source_dir"/log_parser || exit 1
@@ -80,19 +80,15 @@ def build_athena_query(log, database_name, table_name):
     """
 
     current_timestamp = datetime.datetime.utcnow()
-    year = current_timestamp.year
-    month = current_timestamp.month
-    day = current_timestamp.day
-    hour = current_timestamp.hour
-
-    query_string = "ALTER TABLE " \
-        + database_name + "." + table_name  \
-        + "\nADD IF NOT EXISTS\n"  \
-        "PARTITION (\n"  \
-            "\tyear = " + str(year) + ",\n"  \
-            "\tmonth = " + str(month).zfill(2) + ",\n"  \
-            "\tday = " + str(day).zfill(2) + ",\n"  \
-            "\thour = " + str(hour).zfill(2) + ");"
+
+    query_string = (
+        f"ALTER TABLE {database_name}.{table_name}\n"
+        "ADD IF NOT EXISTS\n"
+        "PARTITION (\n"
+            f"\tyear = {current_timestamp.year},\n"
+            f"\tmonth = {current_timestamp.month:02d},\n"
+            f"\tday = {current_timestamp.day:02d},\n"
+            f"\thour = {current_timestamp.hour:02d});")
 
     log.debug(
         "[build_athena_query] Query string:\n%s\n"
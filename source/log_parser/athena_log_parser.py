@@ -15,7 +15,7 @@ import csv
 import datetime
 from os import environ, remove
 from build_athena_queries import build_athena_query_for_app_access_logs, \
-    build_athena_query_for_waf_logs
+    build_athena_query_for_waf_logs, build_result_reuse_configuration
 from lib.boto3_util import create_client
 from lib.s3_util import S3
 from lambda_log_parser import LambdaLogParser
@@ -55,6 +55,7 @@ class AthenaLogParser(object):
         athena_client = create_client('athena')
         s3_output = "s3://%s/athena_results/" % event['accessLogBucket']
         database_name = event['glueAccessLogsDatabase']
+        athena_query_run_schedule = int(environ['ATHENA_QUERY_RUN_SCHEDULE'])
 
         # Dynamically build query string using partition
         # for CloudFront or ALB logs
@@ -66,7 +67,8 @@ class AthenaLogParser(object):
                 event['glueAppAccessLogsTable'],
                 datetime.datetime.utcnow(),
                 int(environ['WAF_BLOCK_PERIOD']),
-                int(environ['ERROR_THRESHOLD'])
+                int(environ['ERROR_THRESHOLD']),
+                athena_query_run_schedule
             )
         else:  # Dynamically build query string using partition for WAF logs
             query_string = build_athena_query_for_waf_logs(
@@ -78,9 +80,18 @@ class AthenaLogParser(object):
                 int(environ['REQUEST_THRESHOLD']),
                 environ['REQUEST_THRESHOLD_BY_COUNTRY'],
                 environ['HTTP_FLOOD_ATHENA_GROUP_BY'],
-                int(environ['ATHENA_QUERY_RUN_SCHEDULE'])
+                athena_query_run_schedule
             )
 
+        # With no period to scan there is no result file to update the IP set
+        # from, so clear it here as the empty query result would have done
+        if query_string is None:
+            self.log.info("[athena_log_parser: execute_athena_query] No query to execute, clear IP set")
+            ip_set_type = self.lambda_log_parser.flood if log_type == 'WAF' \
+                else self.lambda_log_parser.scanners
+            self.lambda_log_parser.update_ip_set(ip_set_type, {'general': {}, 'uriList': {}})
+            return
+
         response = athena_client.start_query_execution(
             QueryString=query_string,
             QueryExecutionContext={'Database': database_name},
@@ -90,7 +101,9 @@ class AthenaLogParser(object):
                     'EncryptionOption': 'SSE_S3'
                 }
             },
-            WorkGroup=event['athenaWorkGroup']
+            WorkGroup=event['athenaWorkGroup'],
+            ResultReuseConfiguration=build_result_reuse_configuration(
+                athena_query_run_schedule)
         )
 
         self.log.info("[athena_log_parser: execute_athena_query] Query Execution Response: {}".format(response))
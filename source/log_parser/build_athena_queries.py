@@ -14,12 +14,215 @@
 ##############################################################################
 
 import datetime
+import functools
+import io
+import itertools
 import json
+import logging
+import time
+from os import environ
+
+try:
+    # orjson parses the request thresholds by country faster; fall back
+    # to the standard library if it is not packaged for the runtime
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
+# The inner query builders do not take a logging object; they log
+# through the module logger, and only when DEBUG logging is configured
+# for the Lambda (see lib.logging_util.set_log_level).
+_module_logger = logging.getLogger(__name__)
+_DEBUG = environ.get('LOG_LEVEL', '').upper() == 'DEBUG'
+
+# First part of the query for each log type, formatted with the
+# Athena/Glue database and table names (and for WAF logs the
+# additional columns from GROUP_BY_ADDITIONAL_COLUMNS).
+QUERY_PART_ONE_CLOUDFRONT_LOGS = (
+    "SELECT\n"
+        "\tclient_ip,\n"
+        "\tMAX_BY(counter, counter) as max_counter_per_min\n"
+    " FROM (\n"
+        "\tWITH logs_with_concat_data AS (\n"
+            "\t\tSELECT\n"
+                "\t\t\trequestip as client_ip,\n"
+                "\t\t\tcast(status as varchar) as status,\n"
+                "\t\t\tparse_datetime( concat( concat( format_datetime(date, 'yyyy-MM-dd'), '-' ), time ), 'yyyy-MM-dd-HH:mm:ss') AS datetime\n"
+            "\t\tFROM\n"
+                "\t\t\t{database_name}.{table_name}")
+QUERY_PART_ONE_ALB_LOGS = (
+    "SELECT\n"
+        "\tclient_ip,\n"
+        "\tMAX_BY(counter, counter) as max_counter_per_min\n"
+    " FROM (\n"
+        "\tWITH logs_with_concat_data AS (\n"
+            "\t\tSELECT\n"
+                "\t\t\tclient_ip,\n"
+                "\t\t\ttarget_status_code AS status,\n"
+                "\t\t\tparse_datetime(time, 'yyyy-MM-dd''T''HH:mm:ss.SSSSSS''Z') AS datetime\n"
+            "\t\tFROM\n"
+                "\t\t\t{database_name}.{table_name}")
+QUERY_PART_ONE_WAF_LOGS = (
+    "SELECT\n"
+        "\tclient_ip{additional_columns_group_two},\n"
+        "\tMAX_BY(counter, counter) as max_counter_per_min\n"
+    " FROM (\n"
+        "\tWITH logs_with_concat_data AS (\n"
+            "\t\tSELECT\n"
+                "\t\t\thttprequest.clientip as client_ip,{additional_columns_group_one}\n"
+                "\t\t\tfrom_unixtime(timestamp/1000) as datetime\n"
+            "\t\tFROM\n"
+                "\t\t\t{database_name}.{table_name}")
+
+# Partition filters (second part of the query) for each way the
+# scanned period can span the year/month/day/hour partitions.
+# Formatted with the start and end datetime of the scanned period
+# and the hour partitions scanned on the start and end days. Hours
+# are listed with IN so that Glue can prune partitions by name.
+# Days fully covered between the start and end days are added at
+# {interior_days} without an hour filter, using the matching
+# PARTITION_FILTER_INTERIOR_DAYS_* template once per year and month.
+PARTITION_FILTER_SAME_DAY = (
+    "\n\t\tWHERE year = {start.year}\n"
+    "\t\tAND month = {start.month:02d}\n"
+    "\t\tAND day = {start.day:02d}\n"
+    "\t\tAND hour IN ({start_hours})")
+PARTITION_FILTER_SAME_MONTH = (
+    "\n\t\tWHERE year = {start.year}\n"
+    "\t\tAND month = {start.month:02d}\n"
+    "\t\tAND (\n"
+    "\t\t\t(day = {start.day:02d} AND hour IN ({start_hours}))\n"
+    "{interior_days}"
+    "\t\t\tOR (day = {end.day:02d} AND hour IN ({end_hours}))\n"
+    "\t\t)\n")
+PARTITION_FILTER_SAME_YEAR = (
+    "\n\t\tWHERE year = {start.year}\n"
+    "\t\tAND (\n"
+    "\t\t\t(month = {start.month:02d} AND day = {start.day:02d} AND hour IN ({start_hours}))\n"
+    "{interior_days}"
+    "\t\t\tOR (month = {end.month:02d} AND day = {end.day:02d} AND hour IN ({end_hours}))\n"
+    "\t\t)\n")
+PARTITION_FILTER_CROSS_YEAR = (
+    "\n\t\tWHERE (year = {start.year}\n"
+    "\t\t\tAND month = {start.month:02d}\n"
+    "\t\t\tAND day = {start.day:02d}\n"
+    "\t\t\tAND hour IN ({start_hours}))\n"
+    "{interior_days}"
+    "\t\tOR (year = {end.year}\n"
+    "\t\t\tAND month = {end.month:02d}\n"
+    "\t\t\tAND day = {end.day:02d}\n"
+    "\t\t\tAND hour IN ({end_hours}))\n")
+PARTITION_FILTER_INTERIOR_DAYS_SAME_MONTH = (
+    "\t\t\tOR (day IN ({days}))\n")
+PARTITION_FILTER_INTERIOR_DAYS_SAME_YEAR = (
+    "\t\t\tOR (month = {month:02d} AND day IN ({days}))\n")
+PARTITION_FILTER_INTERIOR_DAYS_CROSS_YEAR = (
+    "\t\tOR (year = {year}\n"
+    "\t\t\tAND month = {month:02d}\n"
+    "\t\t\tAND day IN ({days}))\n")
+
+# Additional columns for the select (group one) and group by (group two)
+# statements of the WAF logs query, keyed by the user selected group by
+# and whether request thresholds by country are configured. Country is
+# always added when thresholds by country are configured.
+GROUP_BY_ADDITIONAL_COLUMNS = {
+    ('country', False): ('httprequest.country as country,', ', country'),
+    ('country', True): ('httprequest.country as country,', ', country'),
+    ('uri', False): ('httprequest.uri as uri,', ', uri'),
+    ('uri', True): ('httprequest.country as country, httprequest.uri as uri,', ', country, uri'),
+    ('country and uri', False): ('httprequest.country as country, httprequest.uri as uri,', ', country, uri'),
+    ('country and uri', True): ('httprequest.country as country, httprequest.uri as uri,', ', country, uri'),
+    ('none', True): ('httprequest.country as country,', ', country'),
+}
+
+# Built queries are kept for a short time so that a retried or duplicate
+# scheduler invocation on a warm Lambda container reuses the query string
+# instead of rebuilding it. Keys hold every builder input, with the end
+# time stamp truncated to the query run schedule.
+QUERY_CACHE_TTL_SECONDS = 60
+_QUERY_CACHE = {}
+
+
+def get_cached_query(query_key):
+    """
+    This function returns a previously built query string
+    if it is still within the cache TTL.
+
+    Args:
+        query_key: tuple. The builder inputs identifying the query
+
+    Returns:
+        Athena query string or None if not cached or expired
+    """
+    cached = _QUERY_CACHE.get(query_key)
+    if cached is None:
+        return None
+    cached_at, query_string = cached
+    if time.monotonic() - cached_at >= QUERY_CACHE_TTL_SECONDS:
+        del _QUERY_CACHE[query_key]
+        return None
+    return query_string
+
+
+def cache_query(query_key, query_string):
+    """
+    This function stores a built query string and
+    prunes the expired entries from the cache.
+
+    Args:
+        query_key: tuple. The builder inputs identifying the query
+        query_string: string. The Athena query string
+    """
+    now = time.monotonic()
+    for key in [key for key, (cached_at, _) in _QUERY_CACHE.items()
+                if now - cached_at >= QUERY_CACHE_TTL_SECONDS]:
+        del _QUERY_CACHE[key]
+    _QUERY_CACHE[query_key] = (now, query_string)
+
+
+def truncate_to_schedule(timestamp, athena_query_run_schedule):
+    """
+    This function truncates a time stamp to the previous
+    query run schedule boundary within the same hour, so that
+    every run within one schedule interval builds the same query.
+    The hour (and so the scanned partitions) is never changed.
+
+    Args:
+        timestamp: datetime. The time stamp to truncate
+        athena_query_run_schedule: int. The Athena query run schedule (in minutes) set in EventBridge events rule
+
+    Returns:
+        truncated datetime
+    """
+    timestamp = timestamp.replace(second=0, microsecond=0)
+    return timestamp - datetime.timedelta(
+        minutes=timestamp.minute % athena_query_run_schedule)
+
+
+def build_result_reuse_configuration(athena_query_run_schedule):
+    """
+    This function builds the Athena result reuse configuration
+    for the built queries. Queries are identical within one
+    schedule interval, so a retried run reuses the result
+    instead of scanning the logs again.
+
+    Args:
+        athena_query_run_schedule: int. The Athena query run schedule (in minutes) set in EventBridge events rule
+
+    Returns:
+        ResultReuseConfiguration dict for start_query_execution
+    """
+    return {
+        'ResultReuseByAgeConfiguration': {
+            'Enabled': True,
+            'MaxAgeInMinutes': athena_query_run_schedule
+        }
+    }
 
 
 def build_athena_query_for_app_access_logs(
     log, log_type, database_name, table_name, end_timestamp,
-        waf_block_period, error_threshold):
+        waf_block_period, error_threshold, athena_query_run_schedule=1):
     """
     This function dynamically builds athena query
     for cloudfront logs by adding partition values:
@@ -31,12 +234,13 @@ def build_athena_query_for_app_access_logs(
         log: logging object
         database_name: string. The Athena/Glue database name
         table_name: string. The Athena/Glue table name
-        end_timestamp: datetime. The end time stamp of the logs being scanned
+        end_timestamp: datetime. The end time stamp of the logs being scanned; truncated to the query run schedule before use
         waf_block_period: int. The period (in minutes) to block applicable IP addresses
         error_threshold: int. The maximum acceptable bad requests per minute per IP address
+        athena_query_run_schedule: int. The Athena query run schedule (in minutes) set in EventBridge events rule
 
     Returns:
-        Athena query string
+        Athena query string or None if there are no logs to scan
     """
     log.info(
         '[build_athena_query_for_app_access_logs] Start')
@@ -46,13 +250,29 @@ def build_athena_query_for_app_access_logs(
         "[build_athena_query_for_app_access_logs] \
             Get start and end time stamps")
     # ------------------------------------------------
-    query_string = ""
+    end_timestamp = truncate_to_schedule(end_timestamp, athena_query_run_schedule)
+    query_key = (
+        log_type, database_name, table_name, end_timestamp,
+        waf_block_period, error_threshold, athena_query_run_schedule)
+    query_string = get_cached_query(query_key)
+    if query_string is not None:
+        log.info(
+            "[build_athena_query_for_app_access_logs]  \
+            Reuse cached query string")
+        return query_string
+
     start_timestamp = end_timestamp - \
         datetime.timedelta(seconds=60*waf_block_period)
     log.info(
         "[build_athena_query_for_app_access_logs]  \
-            start time: %s; end time: %s"
-            %(start_timestamp, end_timestamp))
+            start time: %s; end time: %s",
+            start_timestamp, end_timestamp)
+    if start_timestamp >= end_timestamp:
+        log.warning(
+            "[build_athena_query_for_app_access_logs]  \
+            No logs to scan, WAF block period is %s minutes", waf_block_period)
+        return None
+    start_timestamp_string = start_timestamp.strftime('%Y-%m-%d %H:%M:%S')
 
     # -------------------------------------------------
     log.debug(
@@ -60,21 +280,30 @@ def build_athena_query_for_app_access_logs(
             Build query")
     # --------------------------------------------------
     if log_type == 'CLOUDFRONT':
-        query_string = build_athena_query_part_one_for_cloudfront_logs(
-            log, database_name, table_name)
+        query_part_one = build_athena_query_part_one_for_cloudfront_logs(
+            database_name, table_name)
     else:  # ALB logs
-        query_string = build_athena_query_part_one_for_alb_logs(
-            log, database_name, table_name)
-    query_string = query_string +  \
-        build_athena_query_part_two_for_partition(
-            log, start_timestamp, end_timestamp)
-    query_string = query_string +  \
-        build_athena_query_part_three_for_app_access_logs(
-            log, error_threshold, start_timestamp)
+        query_part_one = build_athena_query_part_one_for_alb_logs(
+            database_name, table_name)
+    log.debug(
+        "[build_athena_query_for_app_access_logs]  \
+         Query string part One:\n %s", query_part_one)
+    query_buffer = io.StringIO()
+    query_buffer.write(query_part_one)
+    build_athena_query_part_two_for_partition(
+        query_buffer, start_timestamp, end_timestamp)
+    build_athena_query_part_three_for_app_access_logs(
+        query_buffer, error_threshold, start_timestamp_string)
+    query_string = query_buffer.getvalue()
 
     log.info(
         "[build_athena_query_for_app_access_logs]  \
-            Query string:\n %s"%query_string)
+            Query string length: %s", len(query_string))
+    log.debug(
+        "[build_athena_query_for_app_access_logs]  \
+            Query string:\n %s", query_string)
+
+    cache_query(query_key, query_string)
 
     log.info(
         '[build_athena_query_for_app_access_logs] End')
@@ -98,14 +327,14 @@ def build_athena_query_for_waf_logs(
         log: logging object
         database_name: string. The Athena/Glue database name
         table_name: string. The Athena/Glue table name
-        end_timestamp: datetime. The end time stamp of the logs being scanned
+        end_timestamp: datetime. The end time stamp of the logs being scanned; truncated to the query run schedule before use
         waf_block_period: int. The period (in minutes) to block applicable IP addresses
         request_threshold: int. The maximum acceptable bad requests per minute per IP address
         request_threshold_by_country: The maximum acceptable bad requests per minute per Country
         athena_query_run_schedule: The Athena query run schedule (in minutes) set in EventBridge events rule
 
     Returns:
-        Athena query string
+        Athena query string or None if there are no logs to scan
     """
     log.info(
         '[build_athena_query_for_waf_logs] Start')
@@ -115,38 +344,68 @@ def build_athena_query_for_waf_logs(
         "[build_athena_query_for_waf_logs] \
             Get start and end time stamps")
     # ------------------------------------------------
-    query_string = ""
+    end_timestamp = truncate_to_schedule(end_timestamp, athena_query_run_schedule)
+    query_key = (
+        'WAF', database_name, table_name, end_timestamp,
+        waf_block_period, request_threshold,
+        request_threshold_by_country, group_by,
+        athena_query_run_schedule)
+    query_string = get_cached_query(query_key)
+    if query_string is not None:
+        log.info(
+            "[build_athena_query_for_waf_logs]  \
+            Reuse cached query string")
+        return query_string
+
     start_timestamp = end_timestamp - \
         datetime.timedelta(seconds=60*waf_block_period)
     log.info(
         "[build_athena_query_for_waf_logs]  \
-            start time: %s; end time: %s"
-            %(start_timestamp, end_timestamp))
+            start time: %s; end time: %s",
+            start_timestamp, end_timestamp)
+    if start_timestamp >= end_timestamp:
+        log.warning(
+            "[build_athena_query_for_waf_logs]  \
+            No logs to scan, WAF block period is %s minutes", waf_block_period)
+        return None
+    start_timestamp_string = start_timestamp.strftime('%Y-%m-%d %H:%M:%S')
 
     # -------------------------------------------------
     log.debug(
         "[build_athena_query_for_waf_logs]  \
             Build query")
     # --------------------------------------------------
+    request_threshold_by_country_items = \
+        tuple(json_loads(request_threshold_by_country).items()) \
+        if request_threshold_by_country else ()
     additional_columns_group_one, additional_columns_group_two \
         = build_select_group_by_columns_for_waf_logs(
-            log, group_by, request_threshold_by_country)
-    query_string = build_athena_query_part_one_for_waf_logs(
-        log, database_name, table_name, 
+            group_by, request_threshold_by_country_items)
+    query_part_one = build_athena_query_part_one_for_waf_logs(
+        database_name, table_name,
         additional_columns_group_one,
         additional_columns_group_two)
-    query_string = query_string +  \
-        build_athena_query_part_two_for_partition(
-            log, start_timestamp, end_timestamp)
-    query_string = query_string +  \
-        build_athena_query_part_three_for_waf_logs(
-            log, request_threshold, request_threshold_by_country,
-            athena_query_run_schedule, additional_columns_group_two,
-            start_timestamp)
+    log.debug(
+        "[build_athena_query_for_waf_logs]  \
+         Query string part One:\n %s", query_part_one)
+    query_buffer = io.StringIO()
+    query_buffer.write(query_part_one)
+    build_athena_query_part_two_for_partition(
+        query_buffer, start_timestamp, end_timestamp)
+    build_athena_query_part_three_for_waf_logs(
+        query_buffer, request_threshold, request_threshold_by_country_items,
+        athena_query_run_schedule, additional_columns_group_two,
+        start_timestamp_string)
+    query_string = query_buffer.getvalue()
 
     log.info(
         "[build_athena_query_for_waf_logs]  \
-            Query string:\n %s"%query_string)
+            Query string length: %s", len(query_string))
+    log.debug(
+        "[build_athena_query_for_waf_logs]  \
+            Query string:\n %s", query_string)
+
+    cache_query(query_key, query_string)
 
     log.info(
         '[build_athena_query_for_waf_logs] End')
@@ -154,268 +413,280 @@ def build_athena_query_for_waf_logs(
     return query_string
 
 
+@functools.lru_cache(maxsize=8)
 def build_athena_query_part_one_for_cloudfront_logs(
-        log, database_name, table_name):
+        database_name, table_name):
     """
     This function dynamically builds the first part
-    of the athena query.
+    of the athena query. The result is cached as the
+    inputs do not change within a Lambda container.
 
     Args:
-        log: logging object
         database_name: string. The Athena/Glue database name
         table_name: string. The Athena/Glue table name
 
     Returns:
         Athena query string
     """
-    query_string = "SELECT\n" \
-                        "\tclient_ip,\n" \
-                        "\tMAX_BY(counter, counter) as max_counter_per_min\n"  \
-                   " FROM (\n"  \
-                      "\tWITH logs_with_concat_data AS (\n"  \
-                        "\t\tSELECT\n"  \
-                          "\t\t\trequestip as client_ip,\n"  \
-                          "\t\t\tcast(status as varchar) as status,\n"  \
-                          "\t\t\tparse_datetime( concat( concat( format_datetime(date, 'yyyy-MM-dd'), '-' ), time ), 'yyyy-MM-dd-HH:mm:ss') AS datetime\n"  \
-                        "\t\tFROM\n" \
-                        + "\t\t\t" \
-                        + database_name + "." + table_name
-    log.debug(
-        "[build_athena_query_part_one_for_cloudfront_logs]  \
-         Query string part One:\n %s"%query_string)
+    query_string = QUERY_PART_ONE_CLOUDFRONT_LOGS.format(
+        database_name=database_name, table_name=table_name)
     return query_string
 
 
+@functools.lru_cache(maxsize=8)
 def build_athena_query_part_one_for_alb_logs(
-        log, database_name, table_name):
+        database_name, table_name):
     """
     This function dynamically builds the first part
-    of the athena query.
+    of the athena query. The result is cached as the
+    inputs do not change within a Lambda container.
 
     Args:
-        log: logging object
         database_name: string. The Athena/Glue database name
         table_name: string. The Athena/Glue table name
 
     Returns:
         Athena query string
     """
-    query_string = "SELECT\n" \
-                        "\tclient_ip,\n" \
-                        "\tMAX_BY(counter, counter) as max_counter_per_min\n"  \
-                   " FROM (\n"  \
-                      "\tWITH logs_with_concat_data AS (\n"  \
-                        "\t\tSELECT\n"  \
-                          "\t\t\tclient_ip,\n"  \
-                          "\t\t\ttarget_status_code AS status,\n"  \
-                          "\t\t\tparse_datetime(time, 'yyyy-MM-dd''T''HH:mm:ss.SSSSSS''Z') AS datetime\n"  \
-                        "\t\tFROM\n" \
-                        + "\t\t\t" \
-                        + database_name + "." + table_name
-    log.debug(
-        "[build_athena_query_part_one_for_alb_logs]  \
-         Query string part One:\n %s"%query_string)
+    query_string = QUERY_PART_ONE_ALB_LOGS.format(
+        database_name=database_name, table_name=table_name)
     return query_string
 
 
 def build_select_group_by_columns_for_waf_logs(
-        log, group_by, request_threshold_by_country):
+        group_by, request_threshold_by_country_items):
     """
     This function dynamically builds user selected additional columns
     in select and group by statement of the athena query.
 
     Args:
-        log: logging object
         group_by: string. The group by columns (country, uri or both) selected by user
+        request_threshold_by_country_items: tuple. (country, request threshold) pairs configured by user
 
     Returns:
         string of columns
     """
-    
-    additional_columns_group_one = ''
-    additional_columns_group_two = ''
-
-    if group_by.lower() == 'country' or \
-        (group_by.lower() == 'none' and len(request_threshold_by_country) > 0) :
-        additional_columns_group_one = 'httprequest.country as country,'
-        additional_columns_group_two = ', country'
-    elif group_by.lower() == 'uri':
-        # Add country if threshold by country is configured
-        additional_columns_group_one =  \
-            'httprequest.uri as uri,'   \
-            if len(request_threshold_by_country) == 0   \
-            else 'httprequest.country as country, httprequest.uri as uri,'
-        additional_columns_group_two =  \
-            ', uri' \
-            if len(request_threshold_by_country) == 0   \
-            else ', country, uri'
-    elif group_by.lower() == 'country and uri':
-        additional_columns_group_one = 'httprequest.country as country, httprequest.uri as uri,'
-        additional_columns_group_two = ', country, uri'
-
-    log.debug(
-        "[build_select_group_by_columns_for_waf_logs]  \
-         Additional columns group one: %s\nAdditional columns group two: %s"
-         %(additional_columns_group_one, additional_columns_group_two))
+    group_by = group_by.lower()
+    has_request_threshold_by_country = bool(request_threshold_by_country_items)
+    additional_columns_group_one, additional_columns_group_two = \
+        GROUP_BY_ADDITIONAL_COLUMNS.get(
+            (group_by, has_request_threshold_by_country), ('', ''))
+
+    if _DEBUG:
+        _module_logger.debug(
+            "[build_select_group_by_columns_for_waf_logs]  \
+             Additional columns group one: %s\nAdditional columns group two: %s",
+             additional_columns_group_one, additional_columns_group_two)
     return additional_columns_group_one, additional_columns_group_two
 
 
+@functools.lru_cache(maxsize=8)
 def build_athena_query_part_one_for_waf_logs(
-        log, database_name, table_name,
+        database_name, table_name,
         additional_columns_group_one,
         additional_columns_group_two):
     """
     This function dynamically builds the first part
-    of the athena query.
+    of the athena query. The result is cached as the
+    inputs do not change within a Lambda container.
 
     Args:
-        log: logging object
         database_name: string. The Athena/Glue database name
         table_name: string. The Athena/Glue table name
 
     Returns:
         Athena query string
     """
-    query_string = "SELECT\n" \
-                        "\tclient_ip" + additional_columns_group_two + ",\n" \
-                        "\tMAX_BY(counter, counter) as max_counter_per_min\n"  \
-                   " FROM (\n"  \
-                      "\tWITH logs_with_concat_data AS (\n"  \
-                        "\t\tSELECT\n"  \
-                          "\t\t\thttprequest.clientip as client_ip," + additional_columns_group_one + "\n"  \
-                          "\t\t\tfrom_unixtime(timestamp/1000) as datetime\n"  \
-                        "\t\tFROM\n" \
-                        + "\t\t\t" \
-                        + database_name + "." + table_name
-    log.debug(
-        "[build_athena_query_part_one_for_waf_logs]  \
-         Query string part One:\n %s"%query_string)
+    query_string = QUERY_PART_ONE_WAF_LOGS.format(
+        database_name=database_name, table_name=table_name,
+        additional_columns_group_one=additional_columns_group_one,
+        additional_columns_group_two=additional_columns_group_two)
     return query_string
 
 
+def format_hours(first_hour, last_hour):
+    """
+    This function lists the hour partition values
+    between first_hour and last_hour (inclusive).
+
+    Args:
+        first_hour: int. The first hour partition value
+        last_hour: int. The last hour partition value
+
+    Returns:
+        comma separated string of zero padded hours
+    """
+    return ", ".join(f"{hour:02d}" for hour in range(first_hour, last_hour + 1))
+
+
+def format_interior_days(start_timestamp, end_timestamp, interior_template):
+    """
+    This function builds the partition filters for the days
+    strictly between the start and end days, which are
+    scanned in full. Days are grouped by year and month.
+
+    Args:
+        start_timestamp: datetime. The start time stamp of the logs being scanned
+        end_timestamp: datetime. The end time stamp of the logs being scanned
+        interior_template: string. The PARTITION_FILTER_INTERIOR_DAYS_* template to format
+
+    Returns:
+        string of partition filters, empty if there are no interior days
+    """
+    start_date = start_timestamp.date()
+    interior_dates = [
+        start_date + datetime.timedelta(days=day)
+        for day in range(1, (end_timestamp.date() - start_date).days)]
+
+    return "".join(
+        interior_template.format(
+            year=year, month=month,
+            days=", ".join(f"{date.day:02d}" for date in dates))
+        for (year, month), dates in itertools.groupby(
+            interior_dates, key=lambda date: (date.year, date.month)))
+
+
 def build_athena_query_part_two_for_partition(
-        log, start_timestamp, end_timestamp):
+        query_buffer, start_timestamp, end_timestamp):
     """
     This function dynamically builds the second part
-    of the athena query, where partition values are added.
+    of the athena query, where partition values are added,
+    and writes it to query_buffer.
     The query will only scan the logs in the partitions
     that are between start_timestamp and end_timestamp.
 
     Args:
-        log: logging object
+        query_buffer: io.StringIO. The buffer the query string is written to
         start_timestamp: datetime. The start time stamp of the logs being scanned
         end_timestamp: datetime. The end time stamp of the logs being scanned
 
     Returns:
-        Athena query string
+        None
     """
-    start_year = start_timestamp.year
-    start_month = start_timestamp.month
-    start_day = start_timestamp.day
-    start_hour = start_timestamp.hour
-    end_year = end_timestamp.year
-    end_month = end_timestamp.month
-    end_day = end_timestamp.day
-    end_hour = end_timestamp.hour
-
     # same day query filter!
     if (start_timestamp.date() == end_timestamp.date()):
-        log.debug(
-            "[build_athena_query_part_two_for_partition] \
-            Same day query filter")
-        query_string = "\n\t\tWHERE year = " + str(start_year) + "\n"  \
-                       "\t\tAND month = " + str(start_month).zfill(2) + "\n"  \
-                       "\t\tAND day = " + str(start_day).zfill(2) + "\n"  \
-                       "\t\tAND hour between "  \
-                       + str(start_hour).zfill(2) + " and " + str(end_hour).zfill(2)
+        if _DEBUG:
+            _module_logger.debug(
+                "[build_athena_query_part_two_for_partition] \
+                Same day query filter")
+        partition_template = PARTITION_FILTER_SAME_DAY
+        start_hours = end_hours = format_hours(
+            start_timestamp.hour, end_timestamp.hour)
+        interior_template = None
     # different days - cross days query filter!
-    elif (start_year == end_year):
-        log.debug(
-            "[build_athena_query_part_two_for_partition] \
-             Different days - cross days query filter")
-        if (start_month == end_month):  # year and month are the same, but days are different
-            query_string = "\n\t\tWHERE year = " + str(start_year) + "\n"  \
-                        "\t\tAND month = " + str(start_month).zfill(2) + "\n"  \
-                        "\t\tAND (\n"  \
-                        "\t\t\t(day = " + str(start_day).zfill(2) + " AND hour >= " + str(start_hour).zfill(2) + ")\n"  \
-                        "\t\t\tOR (day = " + str(end_day).zfill(2) + " AND hour <= " + str(end_hour).zfill(2) + ")\n"  \
-                        "\t\t)\n"
+    elif (start_timestamp.year == end_timestamp.year):
+        if _DEBUG:
+            _module_logger.debug(
+                "[build_athena_query_part_two_for_partition] \
+                 Different days - cross days query filter")
+        start_hours = format_hours(start_timestamp.hour, 23)
+        end_hours = format_hours(0, end_timestamp.hour)
+        if (start_timestamp.month == end_timestamp.month):  # year and month are the same, but days are different
+            partition_template = PARTITION_FILTER_SAME_MONTH
+            interior_template = PARTITION_FILTER_INTERIOR_DAYS_SAME_MONTH
         else:  # years are the same, but months and days are different
-            query_string = "\n\t\tWHERE year = " + str(start_year) + "\n"  \
-                        "\t\tAND (\n"  \
-                        "\t\t\t(month = " + str(start_month).zfill(2) + " AND day = " + str(start_day).zfill(2) + " AND hour >= " + str(start_hour).zfill(2) + ")\n"  \
-                        "\t\t\tOR (month = " + str(end_month).zfill(2) + " AND day = " + str(end_day).zfill(2) + " AND hour <= " + str(end_hour).zfill(2) + ")\n"  \
-                        "\t\t)\n"
+            partition_template = PARTITION_FILTER_SAME_YEAR
+            interior_template = PARTITION_FILTER_INTERIOR_DAYS_SAME_YEAR
     else:  # years are different
-        log.debug(
-            "[build_athena_query_part_two_for_partition] \
-             Different years - cross years query filter")
-        query_string = "\n\t\tWHERE (year = " + str(start_year) + "\n"  \
-                    "\t\t\tAND month = " + str(start_month).zfill(2) + "\n"  \
-                    "\t\t\tAND day = " + str(start_day).zfill(2) + "\n"  \
-                    "\t\t\tAND hour >= " + str(start_hour).zfill(2) + ")\n"  \
-                    "\t\tOR (year = " + str(end_year) + "\n"  \
-                    "\t\t\tAND month = " + str(end_month).zfill(2) + "\n"  \
-                    "\t\t\tAND day = " + str(end_day).zfill(2) + "\n"  \
-                    "\t\t\tAND hour <= " + str(end_hour).zfill(2) + ")\n"  \
+        if _DEBUG:
+            _module_logger.debug(
+                "[build_athena_query_part_two_for_partition] \
+                 Different years - cross years query filter")
+        partition_template = PARTITION_FILTER_CROSS_YEAR
+        interior_template = PARTITION_FILTER_INTERIOR_DAYS_CROSS_YEAR
+        start_hours = format_hours(start_timestamp.hour, 23)
+        end_hours = format_hours(0, end_timestamp.hour)
+
+    interior_days = format_interior_days(
+        start_timestamp, end_timestamp, interior_template) \
+        if interior_template else ''
+    query_string = partition_template.format(
+        start=start_timestamp, end=end_timestamp,
+        start_hours=start_hours, end_hours=end_hours,
+        interior_days=interior_days)
+
+    if _DEBUG:
+        _module_logger.debug(
+            "[build_athena_query_part_two_for_partition]  \
+             Query string part Two:\n %s", query_string)
+    query_buffer.write(query_string)
+
+
+@functools.lru_cache(maxsize=8)
+def prepare_athena_query_part_three_for_app_access_logs(error_threshold):
+    """
+    This function prepares the third part of the athena query.
+    Only the start time stamp changes between query runs,
+    so the query is split around it and cached.
 
-    log.debug(
-        "[build_athena_query_part_two_for_partition]  \
-         Query string part Two:\n %s"%query_string)
-    return query_string
+    Args:
+        error_threshold: int. The maximum acceptable bad requests per minute per IP address
+
+    Returns:
+        tuple of the query strings before and after the start time stamp
+    """
+    query_string_before_start_timestamp = (
+        "\n\t)\n"
+        "\tSELECT\n"
+            "\t\tclient_ip,\n"
+            "\t\tCOUNT(*) as counter\n"
+        "\tFROM\n"
+            "\t\tlogs_with_concat_data\n"
+        "\tWHERE\n"
+            "\t\tdatetime > TIMESTAMP '")
+    query_string_after_start_timestamp = (
+            "'\n"
+            "\t\tAND status = ANY (VALUES '400', '401', '403', '404', '405')\n"
+        "\tGROUP BY\n"
+            "\t\tclient_ip,\n"
+            "\t\tdate_trunc('minute', datetime)\n"
+        "\tHAVING\n"
+            f"\t\tCOUNT(*) >= {error_threshold}\n"
+        ") GROUP BY\n"
+            "\tclient_ip\n"
+        "ORDER BY\n"
+            "\tmax_counter_per_min DESC\n"
+        "LIMIT 10000;")
+    return query_string_before_start_timestamp, query_string_after_start_timestamp
 
 
 def build_athena_query_part_three_for_app_access_logs(
-        log, error_threshold, start_timestamp):
+        query_buffer, error_threshold, start_timestamp_string):
     """
     This function dynamically builds the third part
-    of the athena query.
+    of the athena query and writes it to query_buffer.
 
     Args:
-        log: logging object
+        query_buffer: io.StringIO. The buffer the query string is written to
         error_threshold: int. The maximum acceptable bad requests per minute per IP address
-        start_timestamp: datetime. The start time stamp of the logs being scanned
+        start_timestamp_string: string. The start time stamp (yyyy-MM-dd HH:mm:ss) of the logs being scanned
 
     Returns:
-        Athena query string
+        None
     """
-    query_string = "\n\t)\n"  \
-                   "\tSELECT\n"  \
-                   "\t\tclient_ip,\n"  \
-                   "\t\tCOUNT(*) as counter\n"  \
-                   "\tFROM\n"  \
-                   "\t\tlogs_with_concat_data\n"  \
-                   "\tWHERE\n"  \
-                   "\t\tdatetime > TIMESTAMP "  \
-                   + "'" + str(start_timestamp)[0:19] + "'"\
-                   "\n\t\tAND status = ANY (VALUES '400', '401', '403', '404', '405')\n"  \
-                   "\tGROUP BY\n"  \
-                   "\t\tclient_ip,\n"  \
-                   "\t\tdate_trunc('minute', datetime)\n"  \
-                   "\tHAVING\n"  \
-                   "\t\tCOUNT(*) >= "  \
-                   + str(error_threshold) + \
-                   "\n) GROUP BY\n"  \
-                   "\tclient_ip\n"  \
-                   "ORDER BY\n" \
-                   "\tmax_counter_per_min DESC\n" \
-                   "LIMIT 10000;"
-    log.debug(
-        "[build_athena_query_part_three_for_app_access_logs]  \
-        Query string part Three:\n %s"%query_string)
-    return query_string
+    query_string_before_start_timestamp, query_string_after_start_timestamp = \
+        prepare_athena_query_part_three_for_app_access_logs(error_threshold)
+    if _DEBUG:
+        _module_logger.debug(
+            "[build_athena_query_part_three_for_app_access_logs]  \
+            Query string part Three:\n %s%s%s", query_string_before_start_timestamp,
+            start_timestamp_string, query_string_after_start_timestamp)
+    query_buffer.write(query_string_before_start_timestamp)
+    query_buffer.write(start_timestamp_string)
+    query_buffer.write(query_string_after_start_timestamp)
 
 
 def build_having_clause_for_waf_logs(
-        log, default_request_threshold,
-        request_threshold_by_country,
+        default_request_threshold,
+        request_threshold_by_country_items,
         athena_query_run_schedule):
     """
     This function dynamically builds having clause of the athena query.
 
     Args:
-        log: logging object
-        group_by: json string. request thresholds for countries configured by user
+        default_request_threshold: int. The maximum acceptable count of requests per IP address within the scheduled query run interval
+        request_threshold_by_country_items: tuple. (country, request threshold) pairs configured by user
+        athena_query_run_schedule: int. The Athena query run schedule (in minutes) set in EventBridge events rule
 
     Returns:
         string of having clause
@@ -424,72 +695,102 @@ def build_having_clause_for_waf_logs(
 
     having_clause_string = "\t\tCOUNT(*) >= " + str(request_threshold_calculated)
 
-    if len(request_threshold_by_country) > 0 :
-        having_clause_string = ''
-        not_in_country_string = ''
+    if request_threshold_by_country_items:
+        having_clause_parts = []
+        countries = []
 
-        request_threshold_by_country_json = json.loads(request_threshold_by_country)
-        for country in request_threshold_by_country_json:
-            request_threshold_for_country = request_threshold_by_country_json[country]
+        for country, request_threshold_for_country in request_threshold_by_country_items:
             request_threshold_for_country_calculated = request_threshold_for_country / athena_query_run_schedule
-            request_threshold_for_country_string = "\t\t(COUNT(*) >= " + str(request_threshold_for_country_calculated) + " AND country = '" +  country + "') OR \n"
-            having_clause_string += request_threshold_for_country_string
-            not_in_country_string += "'" + country + "',"
+            having_clause_parts.append(
+                f"\t\t(COUNT(*) >= {request_threshold_for_country_calculated} AND country = '{country}') OR \n")
+            countries.append(country)
 
-        # Remove last comma and add closing parentheses
-        not_in_country_string = not_in_country_string[:-1] + "))"
-        not_in_country_prefix = "\t\t(COUNT(*) >= " + str(request_threshold_calculated) + " AND country NOT IN ("
-        request_threshold_for_others_string = not_in_country_prefix + not_in_country_string
-        having_clause_string = having_clause_string + request_threshold_for_others_string
+        not_in_country_string = ",".join(f"'{country}'" for country in countries)
+        having_clause_parts.append(
+            f"\t\t(COUNT(*) >= {request_threshold_calculated} AND country NOT IN ({not_in_country_string}))")
+        having_clause_string = "".join(having_clause_parts)
+
+    if _DEBUG:
+        _module_logger.debug(
+            "[build_select_group_by_columns_for_waf_logs]  \
+             Having clause: %s", having_clause_string)
 
-    log.debug(
-        "[build_select_group_by_columns_for_waf_logs]  \
-         Having clause: %s"%having_clause_string)
     return having_clause_string
 
 
+@functools.lru_cache(maxsize=8)
+def prepare_athena_query_part_three_for_waf_logs(
+        default_request_threshold, request_threshold_by_country_items,
+        athena_query_run_schedule, additional_columns_group_two):
+    """
+    This function prepares the third part of the athena query.
+    Only the start time stamp changes between query runs,
+    so the query is split around it and cached.
+
+    Args:
+        default_request_threshold: int. The maximum acceptable count of requests per IP address within the scheduled query run interval (default 5 minutes)
+        request_threshold_by_country_items: tuple. (country, request threshold) pairs for the maximum acceptable count of requests per IP address per specified country within the scheduled query run interval (default 5 minutes)
+        athena_query_run_schedule: int. The Athena query run schedule (in minutes) set in EventBridge events rule
+        additional_columns_group_two: string. The additional columns of the group by statement
+
+    Returns:
+        tuple of the query strings before and after the start time stamp
+    """
+    having_clause = build_having_clause_for_waf_logs(
+                        default_request_threshold, request_threshold_by_country_items,
+                        athena_query_run_schedule)
+
+    query_string_before_start_timestamp = (
+        "\n\t)\n"
+        "\tSELECT\n"
+            f"\t\tclient_ip{additional_columns_group_two},\n"
+            "\t\tCOUNT(*) as counter\n"
+        "\tFROM\n"
+            "\t\tlogs_with_concat_data\n"
+        "\tWHERE\n"
+            "\t\tdatetime > TIMESTAMP '")
+    query_string_after_start_timestamp = (
+            "'\n"
+        "\tGROUP BY\n"
+            f"\t\tclient_ip{additional_columns_group_two},\n"
+            "\t\tdate_trunc('minute', datetime)\n"
+        "\tHAVING\n"
+            f"{having_clause}\n"
+        ") GROUP BY\n"
+            f"\tclient_ip{additional_columns_group_two}\n"
+        "ORDER BY\n"
+            "\tmax_counter_per_min DESC\n"
+        "LIMIT 10000;")
+    return query_string_before_start_timestamp, query_string_after_start_timestamp
+
+
 def build_athena_query_part_three_for_waf_logs(
-        log, default_request_threshold, request_threshold_by_country,
+        query_buffer, default_request_threshold, request_threshold_by_country_items,
         athena_query_run_schedule, additional_columns_group_two,
-        start_timestamp):
+        start_timestamp_string):
     """
     This function dynamically builds the third part
-    of the athena query.
+    of the athena query and writes it to query_buffer.
 
     Args:
-        log: logging object
+        query_buffer: io.StringIO. The buffer the query string is written to
         request_threshold: int. The maximum acceptable count of requests per IP address within the scheduled query run interval (default 5 minutes)
-        start_timestamp: datetime. The start time stamp of the logs being scanned
-        request_threshold_by_country: json string. The maximum acceptable count of requests per IP address per specified country within the scheduled query run interval (default 5 minutes)
+        start_timestamp_string: string. The start time stamp (yyyy-MM-dd HH:mm:ss) of the logs being scanned
+        request_threshold_by_country_items: tuple. (country, request threshold) pairs for the maximum acceptable count of requests per IP address per specified country within the scheduled query run interval (default 5 minutes)
         athena_query_run_schedule: int. The Athena query run schedule (in minutes) set in EventBridge events rule
 
     Returns:
-        Athena query string
+        None
     """
-    having_clause = build_having_clause_for_waf_logs(
-                        log, default_request_threshold, request_threshold_by_country,
-                        athena_query_run_schedule)
-
-    query_string = "\n\t)\n"  \
-                   "\tSELECT\n"  \
-                   "\t\tclient_ip" + additional_columns_group_two + ",\n"  \
-                   "\t\tCOUNT(*) as counter\n"  \
-                   "\tFROM\n"  \
-                   "\t\tlogs_with_concat_data\n"  \
-                   "\tWHERE\n"  \
-                   "\t\tdatetime > TIMESTAMP "  \
-                   + "'" + str(start_timestamp)[0:19] + "'"\
-                   "\n\tGROUP BY\n"  \
-                   "\t\tclient_ip" + additional_columns_group_two + ",\n"  \
-                   "\t\tdate_trunc('minute', datetime)\n"  \
-                   "\tHAVING\n"  \
-                   + having_clause + \
-                   "\n) GROUP BY\n"  \
-                   "\tclient_ip" + additional_columns_group_two + "\n"  \
-                   "ORDER BY\n" \
-                   "\tmax_counter_per_min DESC\n" \
-                   "LIMIT 10000;"
-    log.debug(
-        "[build_athena_query_part_three_for_waf_logs]  \
-        Query string part Three:\n %s"%query_string)
-    return query_string
\ No newline at end of file
+    query_string_before_start_timestamp, query_string_after_start_timestamp = \
+        prepare_athena_query_part_three_for_waf_logs(
+            default_request_threshold, request_threshold_by_country_items,
+            athena_query_run_schedule, additional_columns_group_two)
+    if _DEBUG:
+        _module_logger.debug(
+            "[build_athena_query_part_three_for_waf_logs]  \
+            Query string part Three:\n %s%s%s", query_string_before_start_timestamp,
+            start_timestamp_string, query_string_after_start_timestamp)
+    query_buffer.write(query_string_before_start_timestamp)
+    query_buffer.write(start_timestamp_string)
+    query_buffer.write(query_string_after_start_timestamp)
\ No newline at end of file
@@ -15,6 +15,7 @@
 
 import boto3
 import pytest
+import build_athena_queries
 from os import environ
 from moto import mock_s3, mock_glue, mock_athena, mock_wafv2
 
@@ -80,6 +81,17 @@ def test_environment_vars_setup():
     environ['METRICS_URL'] = 'https://testurl.com/generic'
 
 
+@pytest.fixture(autouse=True)
+def build_athena_queries_cache_clear():
+    """Start every test with empty Athena query caches"""
+    build_athena_queries._QUERY_CACHE.clear()
+    build_athena_queries.build_athena_query_part_one_for_cloudfront_logs.cache_clear()
+    build_athena_queries.build_athena_query_part_one_for_alb_logs.cache_clear()
+    build_athena_queries.build_athena_query_part_one_for_waf_logs.cache_clear()
+    build_athena_queries.prepare_athena_query_part_three_for_app_access_logs.cache_clear()
+    build_athena_queries.prepare_athena_query_part_three_for_waf_logs.cache_clear()
+
+
 @pytest.fixture(scope='module')
 def s3_client():
     with mock_s3():
@@ -12,7 +12,11 @@
 ######################################################################################################################
 
 import datetime
+import importlib
+import io
+import json
 import logging
+import sys
 import build_athena_queries, add_athena_partitions
 from datetime import datetime
 from freezegun import freeze_time
@@ -165,6 +169,159 @@ def test_build_athena_queries_for_waf_logs_eight():
     assert type(query_string) is str
     assert query_string == waf_logs_query
 
+def test_build_athena_query_part_two_for_cross_days_partition():
+    # days between the start and end days are scanned without hour filter
+    query_buffer = io.StringIO()
+    build_athena_queries.build_athena_query_part_two_for_partition(
+        query_buffer, datetime(2020, 5, 4, 22, 33), datetime(2020, 5, 7, 1, 33))
+    query_string = query_buffer.getvalue()
+
+    assert query_string == \
+        "\n\t\tWHERE year = 2020\n" \
+        "\t\tAND month = 05\n" \
+        "\t\tAND (\n" \
+        "\t\t\t(day = 04 AND hour IN (22, 23))\n" \
+        "\t\t\tOR (day IN (05, 06))\n" \
+        "\t\t\tOR (day = 07 AND hour IN (00, 01))\n" \
+        "\t\t)\n"
+
+def test_build_athena_query_part_two_for_cross_years_partition():
+    query_buffer = io.StringIO()
+    build_athena_queries.build_athena_query_part_two_for_partition(
+        query_buffer, datetime(2019, 12, 30, 23, 33), datetime(2020, 1, 2, 0, 33))
+    query_string = query_buffer.getvalue()
+
+    assert query_string == \
+        "\n\t\tWHERE (year = 2019\n" \
+        "\t\t\tAND month = 12\n" \
+        "\t\t\tAND day = 30\n" \
+        "\t\t\tAND hour IN (23))\n" \
+        "\t\tOR (year = 2019\n" \
+        "\t\t\tAND month = 12\n" \
+        "\t\t\tAND day IN (31))\n" \
+        "\t\tOR (year = 2020\n" \
+        "\t\t\tAND month = 01\n" \
+        "\t\t\tAND day IN (01))\n" \
+        "\t\tOR (year = 2020\n" \
+        "\t\t\tAND month = 01\n" \
+        "\t\t\tAND day = 02\n" \
+        "\t\t\tAND hour IN (00))\n"
+
+def build_athena_queries_debug_messages(monkeypatch, caplog, debug):
+    monkeypatch.setattr(build_athena_queries, '_DEBUG', debug)
+    caplog.set_level(logging.DEBUG, logger='build_athena_queries')
+    build_athena_queries.build_athena_query_for_app_access_logs(
+        log, cloudfront_log_type, database_name, table_name,
+        end_timestamp, waf_block_period, error_threshold)
+    build_athena_queries.build_athena_query_for_waf_logs(
+        log, database_name, table_name, end_timestamp, waf_block_period,
+        request_threshold, request_threshold_by_country, no_group_by,
+        athena_query_run_schedule)
+    # getMessage formats the lazy arguments, surfacing any mismatch
+    return [record.getMessage() for record in caplog.records
+            if record.name == 'build_athena_queries']
+
+def test_build_athena_queries_with_debug_logging(monkeypatch, caplog):
+    # inner builders log through the module logger when DEBUG is configured
+    messages = build_athena_queries_debug_messages(monkeypatch, caplog, True)
+    assert any('Query string part Two:' in message for message in messages)
+    assert len([message for message in messages
+                if 'Query string part Three:' in message]) == 2
+    assert any("Having clause: \t\t(COUNT(*) >= 6.0 AND country = 'TR')" in message
+               for message in messages)
+
+def test_build_athena_queries_without_debug_logging(monkeypatch, caplog):
+    assert build_athena_queries_debug_messages(monkeypatch, caplog, False) == []
+
+def test_build_athena_queries_for_empty_period():
+    # nothing to scan when the block period is misconfigured as zero
+    assert build_athena_queries.build_athena_query_for_app_access_logs(
+        log, cloudfront_log_type, database_name, table_name,
+        end_timestamp, 0, error_threshold) is None
+    assert build_athena_queries.build_athena_query_for_waf_logs(
+        log, database_name, table_name, end_timestamp, 0,
+        request_threshold, no_request_threshold_by_country, no_group_by,
+        athena_query_run_schedule) is None
+
+def test_truncate_to_schedule():
+    # truncated to the previous schedule boundary, never to a previous hour
+    assert build_athena_queries.truncate_to_schedule(
+        datetime(2020, 5, 7, 13, 33, 42), athena_query_run_schedule) == datetime(2020, 5, 7, 13, 30)
+    assert build_athena_queries.truncate_to_schedule(
+        datetime(2020, 5, 7, 13, 33, 42), 120) == datetime(2020, 5, 7, 13, 0)
+
+def test_build_result_reuse_configuration():
+    assert build_athena_queries.build_result_reuse_configuration(athena_query_run_schedule) == {
+        'ResultReuseByAgeConfiguration': {
+            'Enabled': True,
+            'MaxAgeInMinutes': athena_query_run_schedule
+        }
+    }
+
+def test_build_athena_queries_reuses_cached_query():
+    query_string = build_athena_queries.build_athena_query_for_app_access_logs(
+        log, cloudfront_log_type, database_name, table_name,
+        end_timestamp, waf_block_period, error_threshold)
+    # a retry within the same minute reuses the query built before
+    cached_query_string = build_athena_queries.build_athena_query_for_app_access_logs(
+        log, cloudfront_log_type, database_name, table_name,
+        end_timestamp.replace(second=42), waf_block_period, error_threshold)
+    assert cached_query_string is query_string
+
+def test_build_athena_queries_cache_expires(monkeypatch):
+    query_key = ('TEST', database_name, table_name)
+    build_athena_queries.cache_query(query_key, 'SELECT 1;')
+    assert build_athena_queries.get_cached_query(query_key) == 'SELECT 1;'
+    monkeypatch.setattr(build_athena_queries, 'QUERY_CACHE_TTL_SECONDS', 0)
+    assert build_athena_queries.get_cached_query(query_key) is None
+    assert query_key not in build_athena_queries._QUERY_CACHE
+
+waf_logs_query_five_having_clause = (
+    "\tHAVING\n"
+    "\t\t(COUNT(*) >= 6.0 AND country = 'TR') OR \n"
+    "\t\t(COUNT(*) >= 20.0 AND country = 'CN') OR \n"
+    "\t\t(COUNT(*) >= 30.0 AND country = 'SE') OR \n"
+    "\t\t(COUNT(*) >= 10.0 AND country NOT IN ('TR','CN','SE'))\n")
+
+def build_athena_query_for_waf_logs_counting_loads(monkeypatch, loads):
+    # wrap the parser to prove the thresholds are parsed, not served from cache
+    parsed = []
+    monkeypatch.setattr(build_athena_queries, 'json_loads',
+                        lambda value: parsed.append(value) or loads(value))
+    query_string = build_athena_queries.build_athena_query_for_waf_logs(
+        log, database_name, table_name,end_timestamp, waf_block_period,
+        request_threshold, request_threshold_by_country, no_group_by,
+        athena_query_run_schedule
+        )
+    assert parsed == [request_threshold_by_country]
+    assert waf_logs_query_five_having_clause in query_string
+    return query_string
+
+def test_build_athena_queries_for_waf_logs_with_orjson(monkeypatch):
+    assert build_athena_queries.json_loads.__module__ == 'orjson'
+    query_string = build_athena_query_for_waf_logs_counting_loads(
+        monkeypatch, build_athena_queries.json_loads)
+
+    with open('./test/test_data/waf_logs_query_5.txt', 'r') as file:
+        waf_logs_query = file.read()
+    assert query_string == waf_logs_query
+
+def test_build_athena_queries_for_waf_logs_without_orjson(monkeypatch):
+    # a None entry in sys.modules makes the import raise ImportError
+    monkeypatch.setitem(sys.modules, 'orjson', None)
+    importlib.reload(build_athena_queries)
+    try:
+        assert build_athena_queries.json_loads is json.loads
+        query_string = build_athena_query_for_waf_logs_counting_loads(
+            monkeypatch, json.loads)
+
+        with open('./test/test_data/waf_logs_query_5.txt', 'r') as file:
+            waf_logs_query = file.read()
+        assert query_string == waf_logs_query
+    finally:
+        monkeypatch.undo()
+        importlib.reload(build_athena_queries)
+
 @freeze_time("2020-05-08 02:21:34", tz_offset=-4)
 def test_add_athena_partitions_build_query_string():
     query_string = add_athena_partitions.build_athena_query(
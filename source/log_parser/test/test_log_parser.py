@@ -14,7 +14,10 @@
 ###############################################################################
 
 from os import environ
+from freezegun import freeze_time
 from log_parser import log_parser
+import athena_log_parser
+from lambda_log_parser import LambdaLogParser
 
 
 UNDEFINED_HANDLER_MESSAGE = "[lambda_handler] undefined handler for this type of event"
@@ -64,6 +67,39 @@ def test_waf_log_athena_parser(waf_log_athena_parser_test_event_setup):
     environ.pop('LOG_TYPE')
 
 
+@freeze_time("2020-05-07 13:33:42")
+def test_waf_log_athena_parser_query_execution(waf_log_athena_parser_test_event_setup, mocker):
+    environ['LOG_TYPE'] = "WAF"
+    event = waf_log_athena_parser_test_event_setup
+    athena_client = mocker.patch.object(athena_log_parser, 'create_client').return_value
+    result = {"message": ATHENA_LOG_PARSER_PROCESSED_MESSAGE}
+    assert result == log_parser.lambda_handler(event, {})
+    kwargs = athena_client.start_query_execution.call_args.kwargs
+    # the scanned window ends on the last schedule boundary, 13:30
+    assert "datetime > TIMESTAMP '2020-05-07 09:30:00'" in kwargs['QueryString']
+    assert kwargs['ResultReuseConfiguration'] == {
+        'ResultReuseByAgeConfiguration': {
+            'Enabled': True,
+            'MaxAgeInMinutes': int(environ['ATHENA_QUERY_RUN_SCHEDULE'])
+        }
+    }
+    environ.pop('LOG_TYPE')
+
+
+def test_waf_log_athena_parser_clears_ip_set_without_period(waf_log_athena_parser_test_event_setup, mocker):
+    environ['LOG_TYPE'] = "WAF"
+    environ['WAF_BLOCK_PERIOD'] = '0'
+    event = waf_log_athena_parser_test_event_setup
+    athena_client = mocker.patch.object(athena_log_parser, 'create_client').return_value
+    update_ip_set = mocker.patch.object(LambdaLogParser, 'update_ip_set')
+    result = {"message": ATHENA_LOG_PARSER_PROCESSED_MESSAGE}
+    assert result == log_parser.lambda_handler(event, {})
+    athena_client.start_query_execution.assert_not_called()
+    update_ip_set.assert_called_once_with(2, {'general': {}, 'uriList': {}})
+    environ['WAF_BLOCK_PERIOD'] = '240'
+    environ.pop('LOG_TYPE')
+
+
 def test_app_log_athena_result_processor(app_log_athena_query_result_test_event_setup):
     event = app_log_athena_query_result_test_event_setup
     result = {"message": ATHENA_APP_LOG_QUERY_RESULT_PROCESSED_MESSAGE}